@@ -0,0 +1,127 @@
+import atexit
+import heapq
+import itertools
+import threading
+import time
+
+import numpy as np
+import sounddevice as sd
+
+# Lower numbers play first
+URGENT = 0      # Detection alerts
+PROMPT = 1      # "ClearView", mode changes
+NARRATION = 2   # Vision model descriptions
+
+
+class Utterance:
+    def __init__(self, audio_data, priority, expires):
+        self.audio_data = audio_data
+        self.priority = priority
+        self.expires = expires
+        self.played = False
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+class AudioPlayer:
+    def __init__(self, sample_rate=24000, block_size=1024):
+        self.sample_rate = sample_rate
+        # Preemption is checked between blocks, 1024 samples is ~40 ms at 24 kHz
+        self.block_size = block_size
+        self.queue = []
+        self.order = itertools.count()
+        self.condition = threading.Condition()
+        self.current = None
+        self.interrupt = threading.Event()
+        self.stream = None
+        self.thread = None
+
+    def start(self):
+        self.stream = sd.OutputStream(samplerate=self.sample_rate, channels=1,
+                                      dtype='float32', blocksize=self.block_size)
+        self.stream.start()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.clear()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+
+    def play(self, audio_data, sample_rate, priority=NARRATION, ttl=None, preempt=False):
+        expires = None if ttl is None else time.time() + ttl
+        utterance = Utterance(self.resample(audio_data, sample_rate), priority, expires)
+        with self.condition:
+            heapq.heappush(self.queue, (priority, next(self.order), utterance))
+            if preempt and self.current is not None and priority < self.current.priority:
+                self.interrupt.set()
+            self.condition.notify()
+        return utterance
+
+    def clear(self, priority=None):
+        # Drops queued and playing utterances at or below the given priority
+        with self.condition:
+            kept = []
+            for item in self.queue:
+                if priority is None or item[0] >= priority:
+                    item[2].done.set()
+                else:
+                    kept.append(item)
+            heapq.heapify(kept)
+            self.queue = kept
+            if self.current is not None and (priority is None or self.current.priority >= priority):
+                self.interrupt.set()
+
+    def resample(self, audio_data, sample_rate):
+        audio_data = np.asarray(audio_data, dtype=np.float32)
+        if audio_data.ndim > 1:
+            audio_data = audio_data.mean(axis=1, dtype=np.float32)
+        if sample_rate != self.sample_rate and len(audio_data):
+            length = int(round(len(audio_data) * self.sample_rate / sample_rate))
+            positions = np.linspace(0, len(audio_data) - 1, length)
+            audio_data = np.interp(positions, np.arange(len(audio_data)), audio_data).astype(np.float32)
+        return audio_data.reshape(-1, 1)
+
+    def _next(self):
+        with self.condition:
+            while True:
+                while not self.queue:
+                    self.condition.wait()
+                _, _, utterance = heapq.heappop(self.queue)
+                if utterance.expires is not None and time.time() > utterance.expires:
+                    utterance.done.set()  # Stale, e.g. a detection summary for a scene that is gone
+                    continue
+                self.current = utterance
+                self.interrupt.clear()
+                return utterance
+
+    def _run(self):
+        while True:
+            utterance = self._next()
+            audio_data = utterance.audio_data
+            for start in range(0, len(audio_data), self.block_size):
+                if self.interrupt.is_set():
+                    break
+                self.stream.write(audio_data[start:start + self.block_size])
+            else:
+                utterance.played = True
+            with self.condition:
+                self.current = None
+            utterance.done.set()
+
+
+player = None
+player_lock = threading.Lock()
+
+
+def get_player():
+    global player
+    with player_lock:
+        if player is None:
+            player = AudioPlayer().start()
+            atexit.register(player.stop)
+        return player
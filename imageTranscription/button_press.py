@@ -1,46 +1,183 @@
+import os
+import queue
+import threading
 import time
-import RPi.GPIO as GPIO
-
-
-
-def button_press():
-
-    BUTTON_GPIO = 16
-    DELAY = 500
-    HOLD = 2200
-
-    start_ms = 0
-    start_press_ms = 0
-
-    mode = 0
-    
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(BUTTON_GPIO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-
-    pressed = False
-    held = False
-
-    while True:
-
-        if not GPIO.input(BUTTON_GPIO):
-            if not pressed and (time.time() * 1000 - start_ms > DELAY):
-                pressed = True
-                start_ms = time.time() * 1000
-            if pressed and not held and (time.time() * 1000 - start_ms > HOLD):
-                held = True
-                if mode == 2:
-                    mode = 0
-                else:
-                    mode = mode + 1
-                print(mode)
-                if(mode == 1):
-                    return 1 # Current implementation 
-                if(mode == 2):
-                    return 2 # Reading Labels
-        else:
-            if pressed and not held:
-                print("pressed")
-                return 0 # Describe closest item
-            pressed = False
-            held = False
-        time.sleep(0.1)
\ No newline at end of file
+from collections import namedtuple
+
+BUTTON_GPIO = 16
+DEBOUNCE = 50
+HOLD = 2200
+
+# down: button went down, press: released before HOLD, hold: still down at
+# HOLD, mode_change: follows every hold with the new mode
+DOWN = "down"
+PRESS = "press"
+HOLD_EVENT = "hold"
+MODE_CHANGE = "mode_change"
+
+ButtonEvent = namedtuple("ButtonEvent", ["kind", "mode", "time"])
+
+
+class FakeGPIO:
+    # Stands in for RPi.GPIO off the Pi and in tests, drive it with
+    # press()/release() or click()
+    BCM = "BCM"
+    IN = "IN"
+    PUD_UP = "PUD_UP"
+    BOTH = "BOTH"
+
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self.levels[pin] = 1
+
+    def input(self, pin):
+        return self.levels.get(pin, 1)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        pass
+
+    def set_level(self, pin, level):
+        if self.levels.get(pin, 1) == level:
+            return
+        self.levels[pin] = level
+        callback = self.callbacks.get(pin)
+        if callback is not None:
+            callback(pin)
+
+    def press(self, pin=BUTTON_GPIO):
+        self.set_level(pin, 0)
+
+    def release(self, pin=BUTTON_GPIO):
+        self.set_level(pin, 1)
+
+    def click(self, pin=BUTTON_GPIO, duration=0.1):
+        self.press(pin)
+        time.sleep(duration)
+        self.release(pin)
+
+
+class ButtonService:
+    # Edge triggered, the CPU idles between presses and a press is seen as
+    # soon as the debounce window allows instead of on the next 100 ms poll
+    def __init__(self, modes_count, gpio=None, pin=BUTTON_GPIO, debounce_ms=DEBOUNCE, hold_ms=HOLD):
+        if gpio is None:
+            import RPi.GPIO as gpio
+        self.gpio = gpio
+        self.modes_count = modes_count
+        self.pin = pin
+        self.debounce_ms = debounce_ms
+        self.hold_ms = hold_ms
+        self.mode = 0
+        self.events = queue.Queue()
+        self.lock = threading.Lock()
+        self.down_time = None
+        self.held = False
+        self.hold_timer = None
+        self.settle_timer = None
+        self.burst_pressed = False
+
+    def start(self):
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(self.pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.add_event_detect(self.pin, self.gpio.BOTH, callback=self.on_edge,
+                                   bouncetime=self.debounce_ms)
+        return self
+
+    def stop(self):
+        self.gpio.remove_event_detect(self.pin)
+        with self.lock:
+            if self.hold_timer is not None:
+                self.hold_timer.cancel()
+            if self.settle_timer is not None:
+                self.settle_timer.cancel()
+
+    def emit(self, kind):
+        self.events.put(ButtonEvent(kind, self.mode, time.time()))
+
+    def on_edge(self, pin):
+        # The level read at the first edge of a bounce can be wrong and
+        # bouncetime may swallow the edge that follows, so the pin is read
+        # again once the debounce window has passed
+        pressed = not self.gpio.input(self.pin)
+        with self.lock:
+            if self.settle_timer is None:
+                self.burst_pressed = pressed  # First level of this burst of edges
+            else:
+                self.settle_timer.cancel()
+            self.settle_timer = threading.Timer(self.debounce_ms / 1000, self.settle)
+            self.settle_timer.daemon = True
+            self.settle_timer.start()
+
+    def settle(self):
+        pressed = not self.gpio.input(self.pin)
+        with self.lock:
+            self.settle_timer = None
+            if self.burst_pressed and not pressed and self.down_time is None:
+                # Down and up again within the debounce window, a quick tap
+                self.emit(DOWN)
+                self.emit(PRESS)
+                return
+            if pressed and self.down_time is None:
+                self.down_time = time.time()
+                self.held = False
+                self.hold_timer = threading.Timer(self.hold_ms / 1000, self.on_hold)
+                self.hold_timer.daemon = True
+                self.hold_timer.start()
+                self.emit(DOWN)
+            elif not pressed and self.down_time is not None:
+                self.hold_timer.cancel()
+                if not self.held:
+                    self.emit(PRESS)
+                self.down_time = None
+
+    def on_hold(self):
+        with self.lock:
+            if self.down_time is None:
+                return
+            if self.gpio.input(self.pin):
+                # The release edge was lost, the button is already up. It
+                # was a tap, not a hold
+                self.emit(PRESS)
+                self.down_time = None
+                return
+            self.held = True
+            self.emit(HOLD_EVENT)
+            self.mode = (self.mode + 1) % self.modes_count
+            self.emit(MODE_CHANGE)
+
+    def get(self, timeout=None):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        # Drops presses that happened while the caller was busy
+        while self.get(timeout=0) is not None:
+            pass
+
+
+buttons = None
+buttons_lock = threading.Lock()
+
+
+def get_buttons(modes_count=4):
+    # CLEARVUE_FAKE_GPIO=1 runs without the Pi's GPIO header
+    global buttons
+    with buttons_lock:
+        if buttons is None:
+            gpio = FakeGPIO() if os.getenv('CLEARVUE_FAKE_GPIO') == '1' else None
+            buttons = ButtonService(modes_count, gpio).start()
+        return buttons
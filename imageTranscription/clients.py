@@ -0,0 +1,55 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) in seconds. The read timeout has to cover the time the
+# vision model takes to produce its first token
+connect_timeout = 3.05
+read_timeout = 30
+timeout = (connect_timeout, read_timeout)
+
+max_retries = 3
+backoff_factor = 0.5
+retry_statuses = (429, 500, 502, 503, 504)
+
+session = None
+openai_client = None
+clients_lock = threading.Lock()
+
+
+def get_session():
+    # One pooled session for the vision endpoint, connections stay alive
+    # between button presses so only the first request pays for TLS
+    global session
+    with clients_lock:
+        if session is None:
+            # read=0: a POST that timed out or dropped mid response may have
+            # been billed and would cost another full read timeout, only
+            # connection failures and retry_statuses are retried
+            retry = Retry(total=max_retries, read=0, backoff_factor=backoff_factor,
+                          status_forcelist=retry_statuses,
+                          allowed_methods=frozenset(["GET", "POST"]))
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        return session
+
+
+def get_openai_client(api_key):
+    global openai_client
+    with clients_lock:
+        if openai_client is None:
+            # openai and httpx take a while to import, only pay for it on first use
+            import httpx
+            from openai import OpenAI
+
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=4,
+                                    keepalive_expiry=120),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+            openai_client = OpenAI(api_key=api_key, http_client=http_client,
+                                   max_retries=max_retries)
+        return openai_client
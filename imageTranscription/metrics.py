@@ -0,0 +1,142 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+# Bucket upper bounds in seconds, from camera frame times up to slow API calls
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    # Fixed buckets for Prometheus plus a bounded window of recent samples
+    # for percentiles, memory stays constant however long the hat runs
+    def __init__(self, window=512):
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def percentile(self, fraction):
+        ordered = sorted(self.recent)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.log = None
+        self.server = None
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+        if self.log is not None:
+            self.log.info(json.dumps({"time": round(time.time(), 3), "stage": stage,
+                                      "ms": round(seconds * 1000, 2)}))
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {stage: {
+                "count": histogram.count,
+                "mean_ms": round(histogram.total / histogram.count * 1000, 2),
+                "p50_ms": round(histogram.percentile(0.5) * 1000, 2),
+                "p95_ms": round(histogram.percentile(0.95) * 1000, 2),
+                "p99_ms": round(histogram.percentile(0.99) * 1000, 2),
+            } for stage, histogram in self.histograms.items() if histogram.count}
+
+    def prometheus_text(self):
+        lines = ["# HELP clearvue_stage_seconds Time spent in each stage of the assistant",
+                 "# TYPE clearvue_stage_seconds histogram"]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'clearvue_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'clearvue_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'clearvue_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def log_to(self, path, max_bytes=1024 * 1024, backups=3):
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.log = logging.getLogger("clearvue.metrics")
+        self.log.setLevel(logging.INFO)
+        self.log.propagate = False
+        self.log.addHandler(handler)
+
+    def serve(self, port=9100, host="127.0.0.1"):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.prometheus_text(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot(), indent=2), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                encoded = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+
+metrics = None
+metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    # CLEARVUE_METRICS_PORT serves /metrics and /metrics.json on localhost,
+    # CLEARVUE_METRICS_HOST=0.0.0.0 exposes them to the network,
+    # CLEARVUE_METRICS_LOG writes every span to a rotating JSONL file
+    global metrics
+    with metrics_lock:
+        if metrics is None:
+            metrics = Metrics()
+            if os.getenv('CLEARVUE_METRICS_LOG'):
+                metrics.log_to(os.getenv('CLEARVUE_METRICS_LOG'))
+            if os.getenv('CLEARVUE_METRICS_PORT'):
+                metrics.serve(int(os.getenv('CLEARVUE_METRICS_PORT')),
+                              os.getenv('CLEARVUE_METRICS_HOST', '127.0.0.1'))
+        return metrics
+
+
+def span(stage):
+    return get_metrics().span(stage)
@@ -0,0 +1,88 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imageTranscription.streaming import split_sentences, stream_completion
+
+# Local stand-in for the chat completions endpoint so streaming can be
+# exercised without network access or an API key. Point the assistant at it
+# with CLEARVUE_CHAT_URL=http://localhost:8000/v1/chat/completions
+
+reply = ("A wooden kitchen table sits in front of you with two white mugs on it. "
+         "To the left is a window with the blinds half open, letting in soft daylight. "
+         "A cereal box labelled Honey Oats stands next to the mugs. "
+         "The room feels calm and tidy.")
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    token_delay = 0.05
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not body.get("stream"):
+            self.send_json({"choices": [{"message": {"role": "assistant", "content": reply}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        for token in reply.split(" "):
+            chunk = {"choices": [{"index": 0, "delta": {"content": token + " "}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.token_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_json(self, data):
+        encoded = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=8000, token_delay=0.05):
+    MockChatHandler.token_delay = token_delay
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def demo(port):
+    url = f"http://127.0.0.1:{port}/v1/chat/completions"
+    start = time.time()
+    chunks = stream_completion(url, {}, {"model": "mock", "messages": []})
+    for sentence in split_sentences(chunks):
+        print(f"{time.time() - start:.2f}s {sentence}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    parser.add_argument("--demo", action="store_true",
+                        help="stream one reply and print sentences as they complete")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.token_delay)
+    if args.demo:
+        demo(args.port)
+        server.shutdown()
+    else:
+        print(f"Mock chat completions on http://127.0.0.1:{args.port}/v1/chat/completions")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -0,0 +1,62 @@
+import subprocess
+import threading
+from collections import namedtuple
+
+import cv2
+
+# text is the words above the noise floor in reading order, confidence is
+# the character weighted mean over every word tesseract found (0-100)
+Reading = namedtuple("Reading", ["text", "confidence", "words"])
+
+
+class TextReader:
+    # Local OCR through tesseract (apt install tesseract-ocr), no network and
+    # a few hundred milliseconds per frame on the Pi. Page segmentation mode
+    # 11 looks for sparse text anywhere in the frame, which suits labels
+    def __init__(self, language="eng", page_segmentation=11, noise_floor=40, timeout=3):
+        self.language = language
+        self.page_segmentation = page_segmentation
+        self.noise_floor = noise_floor
+        self.timeout = timeout
+
+    def read(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        ret, png = cv2.imencode(".png", gray)
+        if not ret:
+            raise ValueError("Failed to encode image")
+        result = subprocess.run(
+            ["tesseract", "stdin", "stdout", "-l", self.language,
+             "--psm", str(self.page_segmentation), "tsv"],
+            input=png.tobytes(), capture_output=True, check=True, timeout=self.timeout)
+        return self.parse(result.stdout.decode('utf-8', errors='replace'))
+
+    def parse(self, tsv):
+        # Columns: level page block par line word left top width height conf text
+        lines = {}
+        total = weighted = 0.0
+        for row in tsv.splitlines()[1:]:
+            fields = row.split("\t")
+            if len(fields) < 12 or not fields[11].strip():
+                continue
+            word, confidence = fields[11].strip(), float(fields[10])
+            if confidence < 0:
+                continue
+            total += len(word)
+            weighted += len(word) * confidence
+            if confidence >= self.noise_floor:
+                lines.setdefault(tuple(fields[2:5]), []).append(word)
+        words = [word for line in lines.values() for word in line]
+        text = "\n".join(" ".join(line) for line in lines.values())
+        return Reading(text, weighted / total if total else 0.0, len(words))
+
+
+text_reader = None
+text_reader_lock = threading.Lock()
+
+
+def get_text_reader():
+    global text_reader
+    with text_reader_lock:
+        if text_reader is None:
+            text_reader = TextReader()
+        return text_reader
@@ -1,90 +1,129 @@
+import time
+boot_start = time.perf_counter()  # Startup is reported relative to this
+import asyncio
 import os
 import base64
-import requests
 import cv2
-import time
-import RPi.GPIO as GPIO
+import threading
 from dotenv import load_dotenv
-from openai import OpenAI
-import sounddevice as sd
-import soundfile as sf
 import base64
 
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import objectDetection.efficientdet as ObjectDetectionStreamer
+from objectDetection.utils.camera import get_camera
+from imageTranscription.button_press import DOWN, MODE_CHANGE, PRESS, get_buttons
+from imageTranscription.audio import NARRATION, PROMPT, get_player
+from imageTranscription.clients import get_session, timeout
+from imageTranscription.metrics import get_metrics, span
+from imageTranscription.ocr import get_text_reader
+from imageTranscription.scene import fingerprint, get_scene_cache
+from imageTranscription.speech import get_engine, get_speech_cache
+import imageTranscription.speech as speech
+from imageTranscription.streaming import speak_streamed, stream_completion
 load_dotenv()  # Loads the .env file into environment variables
 api_key = os.getenv('OPENAI_API_KEY')
 
-image_path = "/home/blackhat/Desktop/transcribe/opencv_frame.png"
+# JPEG settings per mode, max_side of None keeps the full camera resolution
+image_encoding = {
+    0: {"max_side": 512, "quality": 70},   # In Front
+    1: {"max_side": None, "quality": 90},  # Reading Mode
+    2: {"max_side": 768, "quality": 80},   # Story Mode
+}
 
-system_ready = True
+# Reuse the last answer when a mode is pressed again at an unchanged scene.
+# max_distance is the fraction of fingerprint bits allowed to differ, ttl is
+# in seconds. Reading Mode uses a finer fingerprint and a stricter threshold
+# so a different label at the same spot is not mistaken for the last one
+scene_reuse = {
+    0: {"hash_size": 8, "max_distance": 0.1, "ttl": 60},    # In Front
+    1: {"hash_size": 16, "max_distance": 0.05, "ttl": 120},  # Reading Mode
+    2: {"hash_size": 8, "max_distance": 0.08, "ttl": 60},   # Story Mode
+}
 
+# Reading Mode reads text on the device first and only asks the vision model
+# when tesseract is unsure or the text is long. None always uses the cloud
+reading_ocr = {"min_confidence": 80, "max_words": 30, "speech_engine": "local"}
 
-def button_press(base_mode):
-    BUTTON_GPIO = 16
-    DELAY = 500
-    HOLD = 2200
+chat_url = os.getenv('CLEARVUE_CHAT_URL', "https://api.openai.com/v1/chat/completions")
 
-    start_ms = 0
-    start_press_ms = 0
+# Speak the vision response sentence by sentence as it streams in
+stream_responses = True
 
-    mode = base_mode
+# Capture and send the frame on button-down, the answer plays after release
+speculative_capture = True
 
-    modes = ["In Front", "Reading Mode", "Story Mode", "Object Detection Mode"]
+modes = ["In Front", "Reading Mode", "Story Mode", "Object Detection Mode"]
 
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(BUTTON_GPIO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+# Speech engine per mode, see speech.engine_types. None is used for system prompts
+speech_engines = {
+    None: "openai",
+    0: "openai",  # In Front
+    1: "openai",  # Reading Mode
+    2: "openai",  # Story Mode
+    3: "local",   # Object Detection Mode
+}
 
-    pressed = False
-    held = False
+# Object Detection Mode backend, see objectDetection.detectors.detector_types
+detection_backend = "efficientdet"
 
-    while True:
+# Object Detection Mode runs inference every busy_interval seconds while the
+# wearer moves and every idle_interval seconds in a still scene, see
+# objectDetection.scheduler.MotionScheduler
+detection_schedule = {"busy_interval": 0.1, "idle_interval": 2.0}
 
-        if not GPIO.input(BUTTON_GPIO):
-            if not pressed and (time.time() * 1000 - start_ms > DELAY):
-                pressed = True
-                start_ms = time.time() * 1000
-            if pressed and not held and (time.time() * 1000 - start_ms > HOLD):
-                held = True
-                mode = (mode + 1) % len(modes)
-                print("Changed mode to ", mode)
-                text2speech("Changed mode to " + modes[mode])
-        else:
-            if pressed and not held:
-                print("Pressed " + modes[mode])
-                return mode
-            pressed = False
-            held = False
-        time.sleep(0.1)
+# Load and warm the detector in the background after boot instead of on the
+# first entry into Object Detection Mode
+warm_detection = True
 
+# Fixed phrases synthesized at startup so they play without a network round trip
+system_prompts = ["ClearView"] + ["Changed mode to " + name for name in modes]
 
-def save_image(directory="/home/blackhat/Desktop/transcribe/"):
-    cam = cv2.VideoCapture(0)
-    if not cam.isOpened():
-        raise IOError("Cannot open webcam")
+def capture_image(mode):
+    start = time.perf_counter()
+    with get_camera().frame() as (frame, _):
+        get_metrics().observe("capture", time.perf_counter() - start)
+        with span("encode"):
+            base64_image = encode_frame(frame, mode)
+        scene = fingerprint(frame, scene_reuse[mode]["hash_size"]) if mode in scene_reuse else None
+        # OCR runs later, next to the upload, on a copy so the camera slot
+        # is released right away
+        text_frame = frame.copy() if mode == 1 and reading_ocr else None
+    print(f"Captured {len(base64_image)} bytes")
+    return base64_image, scene, text_frame
+
+
+def read_text(frame):
+    try:
+        with span("ocr"):
+            reading = get_text_reader().read(frame)
+        print(f"OCR {reading.confidence:.0f}% on {reading.words} words")
+        return reading
+    except Exception as e:
+        print(e)
 
-    ret, frame = cam.read()
-    cam.release()
-    if not ret:
-        print("Can't receive frame. Exiting ...")
-        return
 
-    frame = cv2.rotate(frame, cv2.ROTATE_180)
-    img_name = os.path.join(directory, "opencv_frame.png")
-    cv2.imwrite(img_name, frame)
-    print(f"{img_name} written!")
-    text2speech("ClearView")
+def read_locally(reading):
+    return (reading is not None and 0 < reading.words <= reading_ocr["max_words"]
+            and reading.confidence >= reading_ocr["min_confidence"])
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read())
-    return encoded_string.decode('utf-8')
+def encode_frame(frame, mode):
+    settings = image_encoding.get(mode, image_encoding[0])
+    height, width = frame.shape[:2]
+    max_side = settings["max_side"]
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        frame = cv2.resize(frame, (round(width * scale), round(height * scale)),
+                           interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode(
+        ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, settings["quality"]])
+    if not ret:
+        raise ValueError("Failed to encode image")
+    return base64.b64encode(buffer).decode('utf-8')
 
 
-def classify_image(base64_image, api_key, mode):
+def build_request(base64_image, api_key, mode):
     if mode == 0:
         print("In Front")
         text_prompt = "Provide a comprehensive description of the image, without mentioning its a photograph or scene to the user, for a visually impaired person, focusing on identifying key objects, characters, and any text, including their arrangement and interactions within the scene. Describe the setting, atmosphere, and highlight any notable emotional or thematic elements. Include details on colors, shapes, and textures to enrich the description. This description should help a visually impaired individual visualize the content and context as if they were seeing it themselves, all within a concise limit of 10 words."
@@ -116,10 +155,14 @@ def classify_image(base64_image, api_key, mode):
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}",
     }
+    return headers, payload
 
+
+def classify_image(base64_image, api_key, mode):
+    headers, payload = build_request(base64_image, api_key, mode)
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        with span("vision_request"):
+            response = get_session().post(chat_url, headers=headers, json=payload, timeout=timeout)
         textjson = response.json()
         text = textjson['choices'][0]['message']['content']
         print(text)
@@ -128,45 +171,289 @@ def classify_image(base64_image, api_key, mode):
         print(e)
 
 
-def text2speech(text):
-    client = OpenAI(api_key=api_key)
-    response = client.audio.speech.create(
-        model="tts-1",
-        voice="shimmer",
-        input=text,
-    )
-    speech_path = "/home/blackhat/Desktop/transcribe/speech.mp3"
-    response.stream_to_file(speech_path)
-    audio_data, sample_rate = sf.read(speech_path)
-    sd.play(audio_data, sample_rate)
-    sd.wait()
+def narrate_image(base64_image, api_key, mode, cancelled=None, gate=None, clips=None, release=None):
+    # Audio waits on gate. first_audio counts from release.time, the PRESS,
+    # when given. A speculative request starts while the button is still down
+    headers, payload = build_request(base64_image, api_key, mode)
+    start = time.time()
+    first_audio = []
+
+    def play_sentence(audio_data, sample_rate):
+        if not first_audio:
+            first_audio.append(True)
+            since = release.time if release is not None and release.time is not None else start
+            get_metrics().observe("first_audio", time.time() - since)
+        if clips is not None:
+            clips.append((audio_data, sample_rate))
+        play(audio_data, sample_rate)
+
+    try:
+        with span("vision_stream"):
+            chunks = stream_completion(chat_url, headers, payload, get_session(), timeout, cancelled)
+            text = speak_streamed(chunks, lambda sentence: synthesize(sentence, mode, cache=False),
+                                  play_sentence, cancelled, gate)
+        print(text)
+        return text
+    except Exception as e:
+        print(e)
+
+
+def synthesize(text, mode=None, engine=None, cache=True):
+    # cache=False for narration, the speech cache is for recurring phrases
+    with span("tts_synthesis"):
+        return speech.synthesize(text, engine or speech_engines.get(mode, speech_engines[None]),
+                                 cache=cache)
 
 
+def play(audio_data, sample_rate):
+    with span("playback"):
+        get_player().play(audio_data, sample_rate).wait()
 
-def main():
-    global system_ready
-    base_mode = 0
-
-    while True:
-        if system_ready:
-            mode = button_press(base_mode)  # Check for button press or hold
-            if mode == 3:
-                system_ready = False  # Prevent further actions during object detection
-                try:
-                    text2speech("ClearView")
-                    ObjectDetectionStreamer.ObjectDetectionStreamer.main()
-                finally:
-                    system_ready = True  # Ensure system_ready is reset even if exited
-                    mode = 0
-                    text2speech("Changed mode to In Front")
+
+def text2speech(text, mode=None, priority=NARRATION, wait=True, preempt=False):
+    # Prompts jump ahead of queued narration, preempt also cuts off the clip
+    # that is playing
+    utterance = get_player().play(*synthesize(text, mode), priority=priority, preempt=preempt)
+    if wait:
+        utterance.wait()
+    return utterance
+
+
+
+class Release(threading.Event):
+    # Set when the button comes up, time is the PRESS event's time.time()
+    time = None
+
+    def press(self, event_time):
+        self.time = event_time
+        self.set()
+
+
+class Orchestrator:
+    # Button events drive cancellable mode tasks on one event loop. Blocking
+    # camera, network and audio work runs in worker threads so the loop keeps
+    # reacting to the button while a request is in flight
+    def __init__(self):
+        self.loop = None
+        self.events = None
+        self.task = None
+        self.task_mode = None
+        self.release = None  # Release of a speculative press, see Release
+        self.detection_ready = None
+
+    def pump_buttons(self):
+        buttons = get_buttons(len(modes))
+        while True:
+            event = buttons.get()
+            self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+    def announce(self, text, preempt=False):
+        # Only mode changes preempt. The press prompt may be synthesized after
+        # the answer to that same press has started, which it must not cut off
+        self.loop.run_in_executor(
+            None, lambda: text2speech(text, priority=PROMPT, wait=False, preempt=preempt))
+
+    def start(self, mode, release=None):
+        # release is a Release for every mode but Object Detection Mode
+        handler = self.detect_objects() if mode == 3 else self.describe(mode, release)
+        self.task = asyncio.ensure_future(handler)
+        self.task_mode = mode
+
+    def cancel(self):
+        # Returns the mode of the task that was still running, if any
+        if self.task is None or self.task.done():
+            return None
+        self.task.cancel()
+        return self.task_mode
+
+    async def describe(self, mode, release):
+        cancelled = threading.Event()
+        # Cloud audio waits on gate. Without OCR that is just the release,
+        # with OCR it also waits until the local reading turned out unsure
+        gate = release
+        try:
+            base64_image, scene, text_frame = await asyncio.to_thread(capture_image, mode)
+            cached = None
+            if scene is not None:
+                settings = scene_reuse[mode]
+                cached = get_scene_cache().lookup(mode, scene, settings["max_distance"], settings["ttl"])
+            if cached is not None:
+                print("Scene unchanged, repeating: " + cached.text)
+                await asyncio.to_thread(release.wait)
+                for clip in cached.clips:
+                    await asyncio.to_thread(play, *clip)
+                return
+
+            reading = None
+            if text_frame is not None:
+                gate = threading.Event()
+                reading_task = asyncio.ensure_future(asyncio.to_thread(read_text, text_frame))
+            cloud = asyncio.ensure_future(self.ask_cloud(base64_image, mode, cancelled, gate, release))
+            if text_frame is not None:
+                reading = await reading_task
+                if read_locally(reading):
+                    # Stop the upload or stream, nothing of it has played
+                    cancelled.set()
+                    gate.set()
+                    print("Read on device: " + reading.text)
+                    clips = await self.speak(reading.text, reading_ocr["speech_engine"], release)
+                    if scene is not None:
+                        get_scene_cache().store(mode, scene, reading.text, clips)
+                    return
+                await asyncio.to_thread(release.wait)
+                gate.set()
+
+            text, clips = await cloud
+            if not text and not clips and reading is not None and reading.words:
+                # Offline or the request failed, an unsure reading beats silence
+                print("Vision request failed, reading on device: " + reading.text)
+                await self.speak(reading.text, reading_ocr["speech_engine"], release)
+            elif text and scene is not None and not cancelled.is_set():
+                get_scene_cache().store(mode, scene, text, clips)
+        except asyncio.CancelledError:
+            # The worker thread notices at the next sentence, anything
+            # already queued is cut off here
+            cancelled.set()
+            release.set()
+            gate.set()
+            get_player().clear(NARRATION)
+            raise
+        except Exception as e:
+            print(e)
+        finally:
+            # From the press, not from a speculative start at button-down
+            if release.time is not None:
+                get_metrics().observe("request_total", time.time() - release.time)
+
+    async def ask_cloud(self, base64_image, mode, cancelled, gate, release):
+        clips = []
+        if stream_responses:
+            text = await asyncio.to_thread(
+                narrate_image, base64_image, api_key, mode, cancelled, gate, clips, release)
+        else:
+            text = await asyncio.to_thread(classify_image, base64_image, api_key, mode)
+            if text and not cancelled.is_set():
+                clips = await self.speak(text, speech_engines[mode], gate)
+        return text, clips
+
+    async def speak(self, text, engine, gate=None):
+        clip = await asyncio.to_thread(synthesize, text, engine=engine, cache=False)
+        if gate is not None:
+            await asyncio.to_thread(gate.wait)
+        await asyncio.to_thread(play, *clip)
+        return [clip]
+
+    async def detect_objects(self):
+        import objectDetection.efficientdet as ObjectDetectionStreamer
+        from objectDetection.detectors import get_detector
+
+        if self.detection_ready is not None:
+            await asyncio.shield(self.detection_ready)  # The interpreter is not safe to share mid warm-up
+        ObjectDetectionStreamer.stream_stop_event.clear()
+        streamer = ObjectDetectionStreamer.ObjectDetectionStreamer(
+            detector=get_detector(detection_backend), text_to_speech=True,
+            speech_engine=speech_engines[3], headless=True,
+            scheduler=ObjectDetectionStreamer.MotionScheduler(**detection_schedule))
+        stream = asyncio.ensure_future(asyncio.to_thread(streamer.start_stream))
+        try:
+            await asyncio.shield(stream)
+        except asyncio.CancelledError:
+            # Let the stages release the camera before the next mode uses it
+            ObjectDetectionStreamer.stream_stop_event.set()
+            await stream
+            raise
+        except Exception as e:
+            print(e)
+        self.return_to_in_front()
+
+    def return_to_in_front(self):
+        get_buttons().mode = 0
+        self.announce("Changed mode to " + modes[0], preempt=True)
+
+    def detecting(self):
+        return self.task_mode == 3 and self.task is not None and not self.task.done()
+
+    def handle(self, event):
+        # Edge to handler, including the debounce settle and the hop from
+        # the button thread onto the loop
+        get_metrics().observe("button_" + event.kind, time.time() - event.time)
+        if event.kind == DOWN:
+            # Every short press is down for well under HOLD, capture and the
+            # upload start now and a hold cancels them with the mode change
+            if speculative_capture and event.mode != 3 and not self.detecting():
+                self.cancel()
+                self.release = Release()
+                self.start(event.mode, self.release)
+        elif event.kind == MODE_CHANGE:
+            self.cancel()
+            self.release = None
+            print("Changed mode to ", event.mode)
+            self.announce("Changed mode to " + modes[event.mode], preempt=True)
+        elif event.kind == PRESS:
+            # A press stops Object Detection Mode, in any other mode it
+            # preempts the narration in flight with a new capture
+            if self.detecting():
+                self.cancel()
+                self.return_to_in_front()
+                return
+            print("Pressed " + modes[event.mode])
+            self.announce("ClearView")
+            if self.release is not None:
+                self.release.press(event.time)
+                self.release = None
             else:
-                base_mode = mode
-                system_ready = False  # Prevent further actions
-                save_image()
-                base64_image = encode_image(image_path)
-                text = classify_image(base64_image, api_key, mode)
-                text2speech(text)
-                system_ready = True  # Ready for new actions
+                self.cancel()
+                release = Release()
+                release.press(event.time)
+                self.start(event.mode, release)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        threading.Thread(target=self.pump_buttons, daemon=True).start()
+        if warm_detection:
+            self.detection_ready = self.loop.run_in_executor(None, warm_up_detection)
+        while True:
+            self.handle(await self.events.get())
+
+
+def warm_up_detection():
+    # Runs the first camera frame through the model so the first real
+    # inference does not pay for tensor allocation
+    try:
+        start = time.perf_counter()
+        from objectDetection.detectors import get_detector
+
+        detector = get_detector(detection_backend).load()
+        loaded = time.perf_counter()
+        with get_camera().frame() as (frame, _):
+            detector.warm_up(frame)
+        end = time.perf_counter()
+        get_metrics().observe("startup_detection", end - start)
+        print(f"Object detection ready: load {loaded - start:.2f}s, first inference {end - loaded:.2f}s, "
+              f"{end - boot_start:.2f}s after launch")
+    except Exception as e:
+        print(e)
+
+
+def main():
+    steps = [
+        ("camera", get_camera),  # Open the camera once so it is warm before the first press
+        ("audio", get_player),
+        ("metrics", get_metrics),
+        ("buttons", lambda: get_buttons(len(modes))),
+        ("prompts", lambda: get_speech_cache().prewarm(system_prompts, get_engine(speech_engines[None]))),
+    ]
+    report = [("imports", time.perf_counter() - boot_start)]
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        report.append((name, time.perf_counter() - start))
+    for name, seconds in report:
+        get_metrics().observe("startup_" + name, seconds)
+    print("Startup: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in report)
+          + f", ready {time.perf_counter() - boot_start:.2f}s after launch")
+    asyncio.run(Orchestrator().run())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+def fingerprint(frame, hash_size=8):
+    # Difference hash: one bit per neighbouring pixel pair of a small gray
+    # thumbnail, stable under exposure changes and small camera shake
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return (small[:, 1:] > small[:, :-1]).ravel()
+
+
+def distance(a, b):
+    # Fraction of differing bits, 0 for the same scene
+    return np.count_nonzero(a != b) / a.size
+
+
+class SceneEntry:
+    def __init__(self, fingerprint, text, clips):
+        self.fingerprint = fingerprint
+        self.text = text
+        self.clips = clips  # (audio_data, sample_rate) per sentence as it was spoken
+        self.time = time.time()
+
+
+class SceneCache:
+    # Recent answers per mode, so a repeat press at the same shelf or label
+    # replays the last description instead of another vision request
+    def __init__(self, max_entries=4):
+        self.entries = {}
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def lookup(self, mode, fingerprint, max_distance, ttl):
+        now = time.time()
+        with self.lock:
+            entries = self.entries.get(mode, ())
+            for entry in reversed(entries):
+                if now - entry.time <= ttl and distance(entry.fingerprint, fingerprint) <= max_distance:
+                    return entry
+        return None
+
+    def store(self, mode, fingerprint, text, clips):
+        with self.lock:
+            entries = self.entries.setdefault(mode, deque(maxlen=self.max_entries))
+            entries.append(SceneEntry(fingerprint, text, clips))
+
+
+scene_cache = None
+scene_cache_lock = threading.Lock()
+
+
+def get_scene_cache():
+    global scene_cache
+    with scene_cache_lock:
+        if scene_cache is None:
+            scene_cache = SceneCache()
+        return scene_cache
@@ -0,0 +1,245 @@
+import hashlib
+import io
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import soundfile as sf
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imageTranscription.clients import get_openai_client
+
+cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "clearvue", "tts")
+
+
+# Engines return mono float32 audio and its sample rate
+class SpeechEngine:
+    name = None
+    voice = None
+
+    def synthesize(self, text):
+        raise NotImplementedError
+
+
+class OpenAISpeechEngine(SpeechEngine):
+    def __init__(self, api_key=None, model="tts-1", voice="shimmer"):
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+        self.name = model
+        self.voice = voice
+
+    def synthesize(self, text):
+        response = get_openai_client(self.api_key).audio.speech.create(
+            model=self.name,
+            voice=self.voice,
+            input=text,
+            response_format="wav",
+        )
+        return sf.read(io.BytesIO(response.content), dtype='float32')
+
+
+class GTTSSpeechEngine(SpeechEngine):
+    name = "gtts"
+
+    def __init__(self, voice="en"):
+        self.voice = voice
+
+    def synthesize(self, text):
+        from gtts import gTTS
+
+        mp3 = io.BytesIO()
+        gTTS(text=text, lang=self.voice).write_to_fp(mp3)
+        mp3.seek(0)
+        return sf.read(mp3, dtype='float32')
+
+
+class EspeakSpeechEngine(SpeechEngine):
+    # Local synthesis through espeak-ng (apt install espeak-ng), no network and
+    # tens of milliseconds per phrase on the Pi
+    name = "espeak-ng"
+
+    def __init__(self, voice="en-us", words_per_minute=175):
+        self.voice = voice
+        self.words_per_minute = words_per_minute
+
+    def synthesize(self, text):
+        result = subprocess.run(
+            ["espeak-ng", "-v", self.voice, "-s", str(self.words_per_minute), "--stdout", text],
+            capture_output=True, check=True)
+        wav = result.stdout
+        # espeak-ng writes a plain 44 byte header followed by 16 bit PCM
+        sample_rate = int.from_bytes(wav[24:28], 'little')
+        audio_data = np.frombuffer(wav, dtype='<i2', offset=44).astype(np.float32) / 32768
+        return audio_data, sample_rate
+
+
+engine_types = {
+    "openai": OpenAISpeechEngine,
+    "gtts": GTTSSpeechEngine,
+    "local": EspeakSpeechEngine,
+}
+engines = {}
+engines_lock = threading.Lock()
+
+
+def get_engine(name):
+    with engines_lock:
+        if name not in engines:
+            engines[name] = engine_types[name]()
+        return engines[name]
+
+
+class SpeechCache:
+    # Only for recurring phrases such as prompts and detection summaries,
+    # narration is one-off and bypasses it with cache=False
+    def __init__(self, directory=cache_dir, max_memory_bytes=32 * 1024 * 1024,
+                 max_disk_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, text, voice, engine):
+        return hashlib.sha1(f"{engine}\0{voice}\0{text}".encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, text, voice, engine):
+        key = self.key(text, voice, engine)
+        path = self.path(key)
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+        if entry is not None:
+            # Keeps phrases served from memory from being evicted on disk
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return entry
+        try:
+            with np.load(path) as data:
+                entry = data["audio"], int(data["sample_rate"])
+        except (OSError, KeyError, ValueError):
+            return None
+        os.utime(path)  # Disk eviction goes by modification time
+        self.remember(key, entry)
+        return entry
+
+    def put(self, text, voice, engine, audio_data, sample_rate):
+        key = self.key(text, voice, engine)
+        audio_data = np.ascontiguousarray(audio_data, dtype=np.float32)
+        entry = audio_data, sample_rate
+        self.remember(key, entry)
+
+        # A unique temp name, the prewarm thread may write the same phrase
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, audio=audio_data, sample_rate=sample_rate)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            os.remove(temp_path)
+            raise
+        self.evict_disk()
+        return entry
+
+    def remember(self, key, entry):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return
+            self.memory[key] = entry
+            self.memory_bytes += entry[0].nbytes
+            while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+                _, (audio_data, _) = self.memory.popitem(last=False)
+                self.memory_bytes -= audio_data.nbytes
+
+    def evict_disk(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # Evicted by another writer
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get_or_synthesize(self, text, engine, cache=True):
+        if not cache:
+            return engine.synthesize(text)
+        entry = self.get(text, engine.voice, engine.name)
+        if entry is None:
+            entry = self.put(text, engine.voice, engine.name, *engine.synthesize(text))
+        return entry
+
+    def prewarm(self, phrases, engine, fallback="local"):
+        # The fallback voice is cached first, it is local and what plays
+        # while the network is down
+        def run():
+            for phrase in phrases:
+                try:
+                    if fallback is not None:
+                        self.get_or_synthesize(phrase, get_engine(fallback))
+                    synthesize(phrase, engine, fallback)
+                except Exception as e:
+                    print(e)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+speech_cache = None
+speech_cache_lock = threading.Lock()
+
+
+def get_speech_cache():
+    global speech_cache
+    with speech_cache_lock:
+        if speech_cache is None:
+            speech_cache = SpeechCache()
+        return speech_cache
+
+
+# After a network engine fails, phrases go straight to the fallback for this
+# many seconds instead of waiting through the client's retries every time
+offline_retry_after = 30
+offline_until = 0.0
+
+
+def synthesize(text, engine="local", fallback="local", cache=True):
+    # Network engines fall back to local speech so the hat still talks offline
+    global offline_until
+    engine = get_engine(engine) if isinstance(engine, str) else engine
+    tts_cache = get_speech_cache()
+    if fallback is None or engine is get_engine(fallback):
+        return tts_cache.get_or_synthesize(text, engine, cache)
+    if time.time() < offline_until:
+        entry = tts_cache.get(text, engine.voice, engine.name) if cache else None
+        return entry if entry is not None else tts_cache.get_or_synthesize(text, get_engine(fallback), cache)
+    try:
+        return tts_cache.get_or_synthesize(text, engine, cache)
+    except Exception as e:
+        print(e)
+        offline_until = time.time() + offline_retry_after
+        return tts_cache.get_or_synthesize(text, get_engine(fallback), cache)
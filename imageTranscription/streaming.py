@@ -0,0 +1,80 @@
+import json
+import queue
+import re
+import threading
+
+import requests
+
+# A sentence ends at . ! or ? followed by optional closing quotes/brackets and whitespace
+sentence_end = re.compile(r'(?<=[.!?])["\')\]]*\s+')
+
+
+def stream_completion(url, headers, payload, session=None, timeout=(5, 60), cancelled=None):
+    # Setting cancelled closes the response at the next line
+    payload = dict(payload, stream=True)
+    session = session or requests
+    with session.post(url, headers=headers, json=payload, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if cancelled is not None and cancelled.is_set():
+                return
+            line = line.decode('utf-8')
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            choices = json.loads(data).get("choices") or []
+            if choices:
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield content
+
+
+def split_sentences(chunks, min_length=20):
+    # Very short fragments ("Dr.", "1.") are held back and merged with the
+    # next sentence so TTS does not speak them on their own
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for match in sentence_end.finditer(buffer):
+            sentence = buffer[start:match.end()].strip()
+            if len(sentence) >= min_length:
+                yield sentence
+                start = match.end()
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def speak_streamed(chunks, synthesize, play, cancelled=None, gate=None):
+    # Sentences are synthesized on a worker thread while the caller plays the
+    # previous one, so network, synthesis and playback overlap. Setting
+    # cancelled stops both sides at the next sentence, playback holds until
+    # gate is set
+    audio = queue.Queue()
+    sentences = []
+    cancelled = cancelled or threading.Event()
+
+    def produce():
+        try:
+            for sentence in split_sentences(chunks):
+                if cancelled.is_set():
+                    break
+                sentences.append(sentence)
+                audio.put(synthesize(sentence))
+        except Exception as e:
+            print(e)
+        finally:
+            audio.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = audio.get()
+        if gate is not None:
+            gate.wait()
+        if item is None or cancelled.is_set():
+            break
+        play(*item)
+    return " ".join(sentences)
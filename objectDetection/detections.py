@@ -0,0 +1,62 @@
+import numpy as np
+
+from objectDetection.labels import classes
+
+# One row per detection. class_id uses the ids in labels.py and box is
+# (ymin, xmin, ymax, xmax) normalized to the frame
+detection_dtype = np.dtype([
+    ("class_id", np.int16),
+    ("score", np.float32),
+    ("box", np.float32, (4,)),
+])
+
+label_names = np.full(max(classes) + 1, "Unknown", dtype=object)
+label_names[list(classes)] = list(classes.values())
+
+
+def postprocess(boxes, class_ids, scores, threshold=0.5, id_offset=1):
+    # EfficientDet emits 0-based class indices, labels.py is 1-based
+    keep = scores > threshold
+    detections = np.empty(np.count_nonzero(keep), dtype=detection_dtype)
+    detections["class_id"] = class_ids[keep] + id_offset
+    detections["score"] = scores[keep]
+    detections["box"] = boxes[keep]
+    return detections
+
+
+def names(detections):
+    return label_names[detections["class_id"]]
+
+
+def count_names(detections):
+    class_ids, counts = np.unique(detections["class_id"], return_counts=True)
+    return list(zip(label_names[class_ids], counts.tolist()))
+
+
+def iou_matrix(boxes_a, boxes_b):
+    # (ymin, xmin, ymax, xmax) boxes, one row per box in a, one column per box in b
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=-1)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=-1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=-1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def postprocess_logits(logits, pred_boxes, threshold=0.9):
+    # NumPy version of the DETR/YOLOS post-process for one image. The last
+    # logit is the "no object" class, boxes are normalized (cx, cy, w, h)
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=-1, keepdims=True)
+    class_ids = probs[:, :-1].argmax(axis=-1)
+    scores = probs[np.arange(len(probs)), class_ids]
+    keep = scores > threshold
+
+    cx, cy, w, h = pred_boxes[keep].T
+    detections = np.empty(np.count_nonzero(keep), dtype=detection_dtype)
+    detections["class_id"] = class_ids[keep]
+    detections["score"] = scores[keep]
+    detections["box"] = np.stack([cy - h / 2, cx - w / 2, cy + h / 2, cx + w / 2], axis=-1)
+    return detections
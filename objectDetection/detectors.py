@@ -0,0 +1,388 @@
+import os
+import threading
+from collections import Counter
+from functools import partial
+
+import cv2
+import numpy as np
+
+from objectDetection.detections import detection_dtype, iou_matrix, postprocess, postprocess_logits
+
+models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+
+class Detector:
+    # Takes BGR frames and returns the RGB image the model saw plus a
+    # detections array (see detections.detection_dtype) with boxes normalized
+    # to that image. Models load on first use or on an explicit load().
+    # Backends implement preprocess, invoke and postprocess so each stage can
+    # be timed on its own
+    name = None
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self.loaded = False
+        self.load_lock = threading.Lock()
+
+    def load(self):
+        with self.load_lock:
+            if not self.loaded:
+                self._load()
+                self.loaded = True
+        return self
+
+    def detect(self, frame, flip=False):
+        # flip rotates by 180 degrees after the resize, on the small image
+        if not self.loaded:
+            self.load()
+        image, inputs = self.preprocess(frame, flip)
+        return image, self.postprocess(self.invoke(inputs))
+
+    def detect_batch(self, frames):
+        # Detections for each frame, backends that can batch override this
+        return [self.detect(frame)[1] for frame in frames]
+
+    def warm_up(self, frame=None):
+        # The first invoke allocates tensors and packs weights, run it
+        # before a real frame has to wait on it
+        if frame is None:
+            frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        self.detect(frame)
+        return self
+
+    def _load(self):
+        raise NotImplementedError
+
+    def preprocess(self, frame, flip=False):
+        raise NotImplementedError
+
+    def invoke(self, inputs):
+        raise NotImplementedError
+
+    def postprocess(self, outputs):
+        raise NotImplementedError
+
+
+class EfficientDetDetector(Detector):
+    name = "efficientdet"
+
+    def __init__(self, model_path=None, frame_resize_dims=(320, 320), threshold=0.5,
+                 num_threads=None, use_xnnpack=True):
+        super().__init__(threshold)
+        self.model_path = model_path or os.path.join(
+            models_dir, "lite-model/lite-model_efficientdet_lite0_detection_metadata_1.tflite")
+        self.frame_resize_dims = frame_resize_dims
+        self.num_threads = num_threads
+        self.use_xnnpack = use_xnnpack
+
+    def _load(self):
+        from objectDetection.interpreter import InputQuantizer, load_interpreter
+
+        self.interpreter = load_interpreter(self.model_path, self.num_threads, self.use_xnnpack)
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        self.quantize_input = InputQuantizer(self.input_details[0])
+        # tensor() hands out views of the interpreter's own buffers. The
+        # runtime refuses to invoke while one is alive, so they are only
+        # fetched for the statement that uses them
+        self.input_tensor = self.interpreter.tensor(self.input_details[0]['index'])
+        self.output_tensors = [self.interpreter.tensor(detail['index'])
+                               for detail in self.output_details[:3]]
+        # The resize has to land on the model's input size
+        _, height, width, _ = self.input_details[0]['shape']
+        self.frame_resize_dims = (int(width), int(height))
+        self.resized = np.empty((height, width, 3), dtype=np.uint8)
+
+    def preprocess(self, frame, flip=False):
+        # Resize into a reused buffer and convert straight into the input
+        # tensor. The returned RGB image is a view of that buffer and is
+        # only valid until the next frame
+        cv2.resize(frame, self.frame_resize_dims, dst=self.resized)
+        if flip:
+            cv2.flip(self.resized, -1, dst=self.resized)
+        self.quantize_input.write(self.resized, self.input_tensor()[0])
+        return self.resized[:, :, ::-1], None
+
+    def invoke(self, inputs=None):
+        from objectDetection.interpreter import dequantize
+
+        self.interpreter.invoke()
+        # Float outputs come back as views, postprocess copies what it keeps
+        # and the views have to be dropped before the next invoke
+        return [dequantize(tensor()[0], detail)
+                for tensor, detail in zip(self.output_tensors, self.output_details)]
+
+    def postprocess(self, outputs):
+        boxes, classes, scores = outputs
+        return postprocess(boxes, classes, scores, self.threshold)
+
+
+class TransformersDetector(Detector):
+    # YOLOS and DETR share the transformers processor/post-process API and the
+    # COCO ids in labels.py, so class ids need no offset
+    def __init__(self, model_name, revision=None, frame_resize_dims=None, threshold=0.9):
+        super().__init__(threshold)
+        self.model_name = model_name
+        self.revision = revision
+        self.frame_resize_dims = frame_resize_dims
+
+    def preprocess(self, frame, flip=False):
+        if self.frame_resize_dims is not None:
+            frame = cv2.resize(frame, self.frame_resize_dims)
+        if flip:
+            frame = cv2.flip(frame, -1)
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame_rgb, self.processor(images=frame_rgb, return_tensors="pt")
+
+    def invoke(self, inputs):
+        import torch
+
+        with torch.inference_mode():
+            return self.model(**inputs)
+
+    def postprocess(self, outputs):
+        return self.to_detections(self.processor.post_process_object_detection(outputs, threshold=self.threshold)[0])
+
+    def detect_batch(self, frames, shortest_edge=None):
+        # One forward pass over all frames, the processor pads them to a
+        # common size. shortest_edge overrides the processor's resize, small
+        # crops do not need the full 800 pixels
+        if not self.loaded:
+            self.load()
+        images = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+        size = {"shortest_edge": shortest_edge, "longest_edge": shortest_edge * 2} if shortest_edge else None
+        inputs = self.processor(images=images, return_tensors="pt", **({"size": size} if size else {}))
+        results = self.processor.post_process_object_detection(self.invoke(inputs), threshold=self.threshold)
+        return [self.to_detections(result) for result in results]
+
+    def to_detections(self, results):
+        # Without target sizes the boxes stay normalized (xmin, ymin, xmax, ymax)
+        detections = np.empty(len(results["scores"]), dtype=detection_dtype)
+        detections["class_id"] = results["labels"].numpy()
+        detections["score"] = results["scores"].numpy()
+        detections["box"] = results["boxes"].numpy()[:, [1, 0, 3, 2]]
+        return detections
+
+
+class YolosDetector(TransformersDetector):
+    name = "yolos"
+
+    def __init__(self, model_name=os.path.join(models_dir, "yolos-tiny"),
+                 frame_resize_dims=(640, 480), threshold=0.9):
+        super().__init__(model_name, frame_resize_dims=frame_resize_dims, threshold=threshold)
+
+    def _load(self):
+        from transformers import YolosImageProcessor, YolosForObjectDetection
+
+        self.processor = YolosImageProcessor.from_pretrained(self.model_name)
+        self.model = YolosForObjectDetection.from_pretrained(self.model_name).eval()
+
+
+class DetrDetector(TransformersDetector):
+    name = "detr"
+
+    def __init__(self, model_name="facebook/detr-resnet-50", revision="no_timm",
+                 frame_resize_dims=None, threshold=0.9):
+        super().__init__(model_name, revision, frame_resize_dims, threshold)
+
+    def _load(self):
+        from transformers import DetrImageProcessor, DetrForObjectDetection
+
+        self.processor = DetrImageProcessor.from_pretrained(self.model_name, revision=self.revision)
+        self.model = DetrForObjectDetection.from_pretrained(self.model_name, revision=self.revision).eval()
+
+
+class FusedPreprocessor:
+    # Resize, BGR to RGB, rescale and normalize in one pass, replacing the
+    # transformers processor for exported models. size is (width, height)
+    def __init__(self, size, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        self.size = size
+        self.mean = np.array(mean, dtype=np.float32).reshape(1, 3, 1, 1)
+        self.inv_std = (1 / np.array(std, dtype=np.float32)).reshape(1, 3, 1, 1)
+
+    def __call__(self, frame):
+        blob = cv2.dnn.blobFromImage(frame, 1 / 255, self.size, swapRB=True, crop=False)
+        blob -= self.mean
+        blob *= self.inv_std
+        return blob
+
+
+class OnnxDetector(Detector):
+    # Serves YOLOS/DETR graphs written by utils/export_model.py. The input
+    # size is baked into the graph and read back from it
+    def __init__(self, model_path, frame_resize_dims=None, threshold=0.9, num_threads=None):
+        super().__init__(threshold)
+        self.model_path = model_path
+        self.frame_resize_dims = frame_resize_dims
+        self.num_threads = num_threads
+
+    def _load(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.num_threads or os.cpu_count()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options,
+                                            providers=["CPUExecutionProvider"])
+        _, _, height, width = self.session.get_inputs()[0].shape
+        self.fused_preprocess = FusedPreprocessor((width, height))
+
+    def preprocess(self, frame, flip=False):
+        if self.frame_resize_dims is not None:
+            frame = cv2.resize(frame, self.frame_resize_dims)
+        pixel_values = self.fused_preprocess(frame)
+        if flip:
+            frame = cv2.flip(frame, -1)
+            pixel_values = np.ascontiguousarray(pixel_values[:, :, ::-1, ::-1])
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), pixel_values
+
+    def invoke(self, pixel_values):
+        return self.session.run(None, {"pixel_values": pixel_values})
+
+    def postprocess(self, outputs):
+        logits, pred_boxes = outputs
+        return postprocess_logits(logits[0], pred_boxes[0], self.threshold)
+
+
+class CascadeDetector(Detector):
+    # EfficientDet on every frame, a heavier model only for its doubtful
+    # boxes. Boxes scoring at least accept are kept as they are. Boxes
+    # between threshold and accept, and boxes overlapping a box of another
+    # class, are cropped and re-scored by the heavy model in one batch. A
+    # crop is kept, with the heavy model's class and score, only if the heavy
+    # model finds an object over the same box. counters tallies what happened
+    # to every box
+    name = "cascade"
+
+    def __init__(self, light="efficientdet", heavy="yolos", threshold=0.3, accept=0.6,
+                 heavy_threshold=0.7, ambiguous_iou=0.5, padding=0.15, max_crops=4,
+                 shortest_edge=320):
+        super().__init__(threshold)
+        self.light = create_detector(light, threshold=threshold)
+        self.heavy = create_detector(heavy, threshold=heavy_threshold)
+        self.accept = accept
+        self.ambiguous_iou = ambiguous_iou
+        self.padding = padding
+        self.max_crops = max_crops
+        self.shortest_edge = shortest_edge
+        self.counters = Counter()
+
+    def _load(self):
+        self.light.load()
+        self.heavy.load()
+
+    def preprocess(self, frame, flip=False):
+        image, inputs = self.light.preprocess(frame, flip)
+        return image, (frame, flip, inputs)
+
+    def invoke(self, inputs):
+        frame, flip, light_inputs = inputs
+        # Light outputs may be views into the interpreter, postprocess copies them
+        detections = self.light.postprocess(self.light.invoke(light_inputs))
+        return self.escalate(frame, flip, detections)
+
+    def postprocess(self, detections):
+        return detections
+
+    def uncertain(self, detections):
+        doubtful = detections["score"] < self.accept
+        iou = iou_matrix(detections["box"], detections["box"])
+        other_class = detections["class_id"][:, None] != detections["class_id"][None, :]
+        doubtful |= ((iou >= self.ambiguous_iou) & other_class).any(axis=1)
+        return doubtful
+
+    def escalate(self, frame, flip, detections):
+        self.counters["frames"] += 1
+        self.counters["boxes"] += len(detections)
+        doubtful = self.uncertain(detections)
+        self.counters["accepted"] += int(np.count_nonzero(~doubtful))
+        if not doubtful.any():
+            return detections
+
+        # The most likely boxes get the crop budget, the rest are dropped
+        candidates = np.flatnonzero(doubtful)
+        candidates = candidates[np.argsort(-detections["score"][candidates])]
+        self.counters["over_budget"] += max(0, len(candidates) - self.max_crops)
+        candidates = candidates[:self.max_crops]
+        crops, inner_boxes = zip(*(self.crop(frame, flip, box) for box in detections["box"][candidates]))
+
+        self.counters["escalated_frames"] += 1
+        self.counters["escalated"] += len(candidates)
+        if isinstance(self.heavy, TransformersDetector):
+            results = self.heavy.detect_batch(crops, self.shortest_edge)
+        else:
+            results = self.heavy.detect_batch(crops)
+
+        keep = ~doubtful
+        for index, inner_box, heavy in zip(candidates, inner_boxes, results):
+            overlap = iou_matrix(inner_box[None], heavy["box"])[0] if len(heavy) else np.empty(0)
+            matches = np.flatnonzero(overlap >= 0.3)
+            if not len(matches):
+                self.counters["rejected"] += 1
+                continue
+            best = matches[np.argmax(heavy["score"][matches])]
+            self.counters["confirmed"] += 1
+            if heavy["class_id"][best] != detections["class_id"][index]:
+                self.counters["relabeled"] += 1
+            detections["class_id"][index] = heavy["class_id"][best]
+            detections["score"][index] = heavy["score"][best]
+            keep[index] = True
+        return detections[keep]
+
+    def crop(self, frame, flip, box):
+        # Returns the padded crop, upright, and the box in its normalized
+        # coordinates. Boxes from a flipped frame are mapped back first
+        ymin, xmin, ymax, xmax = box.tolist()
+        if flip:
+            ymin, xmin, ymax, xmax = 1 - ymax, 1 - xmax, 1 - ymin, 1 - xmin
+        height, width = frame.shape[:2]
+        pad_y, pad_x = (ymax - ymin) * self.padding, (xmax - xmin) * self.padding
+        top, left = max(0, int((ymin - pad_y) * height)), max(0, int((xmin - pad_x) * width))
+        bottom = min(height, max(top + 1, int(np.ceil((ymax + pad_y) * height))))
+        right = min(width, max(left + 1, int(np.ceil((xmax + pad_x) * width))))
+        crop = frame[top:bottom, left:right]
+        crop_height, crop_width = bottom - top, right - left
+        inner = np.array([(ymin * height - top) / crop_height, (xmin * width - left) / crop_width,
+                          (ymax * height - top) / crop_height, (xmax * width - left) / crop_width],
+                         dtype=np.float32)
+        if flip:
+            crop = cv2.flip(crop, -1)
+            inner = 1 - inner[[2, 3, 0, 1]]
+        return crop, inner
+
+    def stats(self):
+        boxes = self.counters["boxes"]
+        frames = self.counters["frames"]
+        return dict(self.counters,
+                    escalation_rate=round(self.counters["escalated"] / boxes, 3) if boxes else 0.0,
+                    escalated_frame_rate=round(self.counters["escalated_frames"] / frames, 3) if frames else 0.0)
+
+
+detector_types = {
+    "efficientdet": EfficientDetDetector,
+    "yolos": YolosDetector,
+    "detr": DetrDetector,
+    "yolos-onnx": partial(OnnxDetector, os.path.join(models_dir, "yolos-tiny.onnx")),
+    "yolos-onnx-int8": partial(OnnxDetector, os.path.join(models_dir, "yolos-tiny.int8.onnx")),
+    "detr-onnx": partial(OnnxDetector, os.path.join(models_dir, "detr-resnet-50.onnx")),
+    "detr-onnx-int8": partial(OnnxDetector, os.path.join(models_dir, "detr-resnet-50.int8.onnx")),
+    "cascade": CascadeDetector,
+    "cascade-detr": partial(CascadeDetector, heavy="detr"),
+    "cascade-onnx": partial(CascadeDetector, heavy="yolos-onnx"),
+}
+
+
+def create_detector(name, **kwargs):
+    return detector_types[name](**kwargs)
+
+
+detectors = {}
+detectors_lock = threading.Lock()
+
+
+def get_detector(name):
+    # One loaded model per backend, shared by every Object Detection Mode session
+    with detectors_lock:
+        if name not in detectors:
+            detectors[name] = create_detector(name)
+        return detectors[name]
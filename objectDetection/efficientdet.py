@@ -1,18 +1,16 @@
-from objectDetection.labels import classes
+from objectDetection.detections import count_names, names
+from objectDetection.detectors import create_detector
+from objectDetection.scheduler import MotionScheduler
+from objectDetection.tracker import Tracker, track_dtype
+from objectDetection.utils.camera import get_camera
+from objectDetection.utils.pipeline import DropOldestQueue
+from imageTranscription.metrics import span
 import objectDetection.efficientdet as ObjectDetectionStreamer
-from collections import Counter
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw
-import tensorflow as tf
-from gtts import gTTS
-import pygame
-import pygame.mixer
-import tempfile
-from gtts import gTTS
 import threading
 import time
-import RPi.GPIO as GPIO
 
 import os
 import sys
@@ -21,177 +19,187 @@ sys.path.append(project_dir)
 
 stream_stop_event = threading.Event()
 
-def monitor_button():
-    BUTTON_GPIO = 16
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(BUTTON_GPIO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-
-    while True:
-        if not GPIO.input(BUTTON_GPIO):  # Button is pressed
+def button_press():
+    # Imported here so the benchmark can render without audio or GPIO
+    from imageTranscription.button_press import HOLD_EVENT, PRESS, get_buttons
+
+    # Any press or hold ends the stream
+    buttons = get_buttons()
+    while not stream_stop_event.is_set():
+        event = buttons.get(timeout=0.1)
+        if event is not None and event.kind in (PRESS, HOLD_EVENT):
             print("Button pressed, exiting.")
-            return
-        time.sleep(0.1)  # Debounce delay
+            stream_stop_event.set()
 
-def button_press():
-    monitor_button_thread = threading.Thread(target=monitor_button)
-    monitor_button_thread.start()
-    monitor_button_thread.join()
-    stream_stop_event.set()
+def describe_counts(detections):
+    return ', '.join(
+        [f"{count} {name}{'s' if count > 1 else ''}" for name, count in count_names(detections)])
 
 class ObjectDetectionStreamer:
-    def __init__(self, model_path, frame_resize_dims=(320, 320), skip_frames=10, flip_camera=False, text_to_speech=False):
-        self.model_path = model_path
-        self.frame_resize_dims = frame_resize_dims
-        self.skip_frames = skip_frames
+    def __init__(self, detector="efficientdet", flip_camera=False, text_to_speech=False, speech_engine="local", headless=False,
+                 scheduler=None):
+        # Any backend from detectors.detector_types, by name or as an instance
+        self.detector = create_detector(detector) if isinstance(detector, str) else detector
         self.flip_camera = flip_camera
         self.text_to_speech = text_to_speech
-        self.interpreter = tf.lite.Interpreter(model_path=self.model_path)
-        self.interpreter.allocate_tensors()
-        self.input_details = self.interpreter.get_input_details()
-        self.output_details = self.interpreter.get_output_details()
-        self.labels = classes
-        self.previous_summary = set()
+        self.speech_engine = speech_engine
+        # Headless skips all drawing, the hat has no display
+        self.headless = headless
+        # Without a scheduler every frame is inferred, with one (see
+        # scheduler.MotionScheduler) the tracks carry the boxes through the
+        # frames in between
+        self.tracker = Tracker()
+        self.scheduler = scheduler
+        self.render_size = None
+        # Tracks as of the last announcement, only changes are spoken
+        self.previous_summary = np.empty(0, dtype=track_dtype)
         self.last_tts_time = time.time()
-        self.tts_delay = 5
+        self.tts_delay = 2
 
-    def draw_boxes_with_labels(self, image, boxes, classes, scores, labels):
+    def draw_boxes_with_labels(self, image, detections):
         draw = ImageDraw.Draw(image)
-        for box, class_id, score in zip(boxes, classes, scores):
-            class_id = int(class_id) + 1
-            if score > 0.5:
-                ymin, xmin, ymax, xmax = box
-                (left, right, top, bottom) = (xmin * image.width, xmax * image.width,
-                                              ymin * image.height, ymax * image.height)
-                draw.rectangle([(left, top), (right, bottom)],
-                               outline="red", width=3)
-
-                class_name = f"Classes: {labels.get(class_id, class_id)}"
-                score = float(score)
-                rounded_score = labels.get(
-                    round(score, 3), f"Confience: {round(score, 3):.3f}")
-                coordinates = f"({left:.1f}, {top:.1f}), ({right:.1f}, {bottom:.1f})"
-                draw.text((left, top), class_name, fill="red")
-                draw.text((left, top + 20), rounded_score, fill="red")
-                draw.text((left, top + 40), coordinates, fill="red")
-
-    def process_frame(self, frame):
-        if self.flip_camera:
-            frame = cv2.flip(frame, -1)
-        frame_small = cv2.resize(frame, self.frame_resize_dims)
-        frame_small = cv2.cvtColor(frame_small, cv2.COLOR_BGR2RGB)
-        input_data = np.expand_dims(frame_small, axis=0)
-        self.interpreter.set_tensor(self.input_details[0]['index'], input_data)
-        self.interpreter.invoke()
-        boxes = self.interpreter.get_tensor(self.output_details[0]['index'])[0]
-        classes = self.interpreter.get_tensor(
-            self.output_details[1]['index'])[0]
-        scores = self.interpreter.get_tensor(
-            self.output_details[2]['index'])[0]
+        scale = np.array([image.height, image.width, image.height, image.width], dtype=np.float32)
+        pixel_boxes = detections["box"] * scale
+        for (top, left, bottom, right), class_name, score in zip(
+                pixel_boxes.tolist(), names(detections), detections["score"].tolist()):
+            draw.rectangle([(left, top), (right, bottom)],
+                           outline="red", width=3)
+            coordinates = f"({left:.1f}, {top:.1f}), ({right:.1f}, {bottom:.1f})"
+            draw.text((left, top), f"Classes: {class_name}", fill="red")
+            draw.text((left, top + 20), f"Confidence: {score:.3f}", fill="red")
+            draw.text((left, top + 40), coordinates, fill="red")
+
+    def detect(self, frame):
+        return self.detector.detect(frame, self.flip_camera)
+
+    def render(self, frame_small, detections):
         image = Image.fromarray(frame_small)
-        self.draw_boxes_with_labels(image, boxes, classes, scores, self.labels)
-        summary = self.summarize_detected_objects(
-            boxes, classes, scores, self.labels)
+        self.draw_boxes_with_labels(image, detections)
+        return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
 
-        return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR), summary
+    def process_frame(self, frame):
+        # Returns None for a skipped frame when there is nothing to draw
+        if self.scheduler is None or self.scheduler.should_infer(frame) or self.render_size is None:
+            with span("detection_inference"):
+                frame_small, detections = self.detect(frame)
+                self.render_size = frame_small.shape[1::-1]
+                tracks = self.tracker.update(detections)
+        else:
+            frame_small = None
+            tracks = self.tracker.predict()
+            if self.headless:
+                return None
+        if self.headless:
+            return None, tracks
+        if frame_small is None:
+            frame_small = cv2.resize(frame, self.render_size)
+            if self.flip_camera:
+                frame_small = cv2.flip(frame_small, -1)
+            frame_small = cv2.cvtColor(frame_small, cv2.COLOR_BGR2RGB)
+        return self.render(frame_small, tracks), tracks
 
     def start_stream(self):
         global stream_stop_event
-        cap = cv2.VideoCapture(0)
+        # Capture runs on the camera thread, inference and speech get their
+        # own stages and this thread only presents results
+        results = DropOldestQueue(maxsize=1)
+        summaries = DropOldestQueue(maxsize=1)
+        stages = [threading.Thread(target=self.inference_stage, args=(results,), daemon=True)]
+        if self.text_to_speech:
+            stages.append(threading.Thread(target=self.speech_stage, args=(summaries,), daemon=True))
+        for stage in stages:
+            stage.start()
         try:
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                for _ in range(self.skip_frames):
-                    cap.grab()
-                processed_frame, summary = self.process_frame(frame)
-                print(summary)
-                cv2.imshow('Video with Boxes and Labels', processed_frame)
-                if cv2.waitKey(1) & 0xFF == ord('q') or stream_stop_event.is_set():
-                    break
-                if not self.text_to_speech:
+            while not stream_stop_event.is_set():
+                result = results.get(timeout=0.1)
+                if result is None:
                     continue
-                current_objects = {(class_name, coordinates)
-                                   for class_name, coordinates in summary}
-                self.tts_summarize(current_objects)
+                processed_frame, detections = result
+                print(list(zip(names(detections), detections["score"].round(3).tolist())))
+                if processed_frame is not None:
+                    cv2.imshow('Video with Boxes and Labels', processed_frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+                if self.text_to_speech:
+                    summaries.put(detections)
         finally:
-            cap.release()
-            cv2.destroyAllWindows()
-            stream_stop_event.clear()
-
-    def take_picture(self, warmup_frames=30):
-        cap = cv2.VideoCapture(0)
+            stream_stop_event.set()
+            for stage in stages:
+                stage.join()
+            if not self.headless:
+                cv2.destroyAllWindows()
+            if hasattr(self.detector, "stats"):
+                print(f"Cascade: {self.detector.stats()}")
+
+    def inference_stage(self, results):
+        # Always runs on the newest frame, whatever arrived while the model
+        # was busy is skipped
+        camera = get_camera()
+        seq = None
+        while not stream_stop_event.is_set():
+            try:
+                with camera.frame(after=seq, timeout=0.5) as (frame, seq):
+                    result = self.process_frame(frame)
+            except IOError:
+                continue
+            if result is not None:
+                results.put(result)
+
+    def speech_stage(self, summaries):
+        while not stream_stop_event.is_set():
+            detections = summaries.get(timeout=0.1)
+            if detections is not None:
+                self.tts_summarize(detections)
+
+    def take_picture(self):
         try:
-            for _ in range(warmup_frames):
-                ret, frame = cap.read()
-                if not ret:
-                    raise ValueError("Failed to capture image during warmup")
-
-            ret, frame = cap.read()
-
-            if not ret:
-                raise ValueError("Failed to capture image")
-
-            processed_frame = self.process_frame(frame)
+            with get_camera().frame() as (frame, _):
+                processed_frame = self.render(*self.detect(frame))
             cv2.imshow('Image with Boxes and Labels', processed_frame)
             cv2.waitKey(0)
         finally:
-            cap.release()
             cv2.destroyAllWindows()
 
-    def summarize_detected_objects(self, boxes, classes, scores, labels):
-        summary = set()
-        for box, class_id, score in zip(boxes, classes, scores):
-            if score > 0.5:
-                class_id = int(class_id) + 1
-                ymin, xmin, ymax, xmax = box
-                coordinates = f"Coordinates: ({xmin:.2f}, {ymin:.2f}), ({xmax:.2f}, {ymax:.2f})"
-                class_name = labels.get(class_id, "Unknown")
-                summary.add((class_name, coordinates))
-        return summary
-
-    def tts_summarize(self, current_objects):
-
+    def tts_summarize(self, tracks):
         current_time = time.time()
         if current_time - self.last_tts_time < self.tts_delay:
             return
-        # Determine new and lost objects by comparing current and previous Counter objects
-        object_names = Counter([name for name, _ in current_objects])
-
-        if object_names:
-            details = ', '.join(
-                [f"{count} {name}{'s' if count > 1 else ''}" for name, count in object_names.items()])
-            message = f"In view: {details}."
-        else:
+        previous = self.previous_summary
+        arrived = tracks[~np.isin(tracks["track_id"], previous["track_id"])]
+        departed = previous[~np.isin(previous["track_id"], tracks["track_id"])]
+        if not len(arrived) and not len(departed):
             return
 
-        tts = gTTS(text=message, lang='en')
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        tts.save(temp_file.name)
-        temp_file.close()
+        parts = []
+        if len(arrived):
+            parts.append(f"New: {describe_counts(arrived)}.")
+        if len(departed):
+            parts.append(f"Gone: {describe_counts(departed)}.")
+        message = " ".join(parts)
 
-        self.play_audio_async(temp_file.name)
+        from imageTranscription.speech import synthesize
+        with span("detection_tts"):
+            audio_data, sample_rate = synthesize(message, self.speech_engine)
 
-        # Update previous summary with current object names for the next comparison
+        self.play_audio_async(audio_data, sample_rate)
+
+        # Changes that came in while rate limited are announced next time
         self.last_tts_time = current_time
-        self.previous_summary = set([name for name, _ in current_objects])
-
-    def play_audio_async(self, file_path):
-        def play_audio(file_path):
-            pygame.mixer.init()
-            pygame.mixer.music.load(file_path)
-            pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-        threading.Thread(target=play_audio, args=(file_path,)).start()
-
-    def main():
+        self.previous_summary = tracks
+
+    def play_audio_async(self, audio_data, sample_rate):
+        from imageTranscription.audio import URGENT, get_player
+        # Summaries older than tts_delay are stale and dropped by the player
+        get_player().play(audio_data, sample_rate, priority=URGENT,
+                          ttl=self.tts_delay, preempt=True)
+
+    def main(speech_engine="local", detector="efficientdet"):
+        stream_stop_event.clear()
+        streamer = ObjectDetectionStreamer(
+            detector=detector, text_to_speech=True, speech_engine=speech_engine, headless=True,
+            scheduler=MotionScheduler())
         button_thread = threading.Thread(target=button_press)
         button_thread.start()
-        model_path = os.path.join(
-            project_dir, "objectDetection/models/lite-model/lite-model_efficientdet_lite0_detection_metadata_1.tflite")
-        streamer = ObjectDetectionStreamer(
-            model_path=model_path, flip_camera=True, text_to_speech=True)
         streamer.start_stream()
         button_thread.join()
 
@@ -0,0 +1,75 @@
+import os
+
+import cv2
+import numpy as np
+
+# Prefer the standalone runtime, importing full TensorFlow just for the
+# interpreter costs several seconds of startup on the Pi
+try:
+    from tflite_runtime.interpreter import Interpreter, OpResolverType
+except ImportError:
+    try:
+        from ai_edge_litert.interpreter import Interpreter, OpResolverType
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+        OpResolverType = tf.lite.experimental.OpResolverType
+
+
+def load_interpreter(model_path, num_threads=None, use_xnnpack=True):
+    # XNNPACK is the runtime's default delegate for the builtin op resolver,
+    # it picks up num_threads from the interpreter
+    resolver = OpResolverType.AUTO if use_xnnpack else OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    interpreter = Interpreter(model_path=model_path,
+                              num_threads=num_threads or os.cpu_count(),
+                              experimental_op_resolver_type=resolver)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+class InputQuantizer:
+    # Maps RGB uint8 pixels to whatever the model's input tensor expects.
+    # uint8 models take the pixels as is, int8 models take them shifted by
+    # 128 and float models take (pixel - mean) / std
+    def __init__(self, input_detail, mean=127.5, std=127.5):
+        self.dtype = input_detail['dtype']
+        self.scale, self.zero_point = input_detail['quantization']
+        self.mean = mean
+        self.std = std
+        self.rgb = None
+
+    def write(self, bgr, out):
+        # Color conversion and quantization straight into out, normally a
+        # view of the input tensor, without allocating per frame
+        if self.dtype == np.uint8:
+            cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=out)
+        elif self.dtype == np.int8:
+            pixels = out.view(np.uint8)
+            cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=pixels)
+            np.bitwise_xor(pixels, 0x80, out=pixels)
+        else:
+            if self.rgb is None or self.rgb.shape != bgr.shape:
+                self.rgb = np.empty_like(bgr)
+            cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=self.rgb)
+            if self.dtype == np.float32 and not self.scale:
+                np.multiply(self.rgb, np.float32(1 / self.std), out=out, dtype=np.float32)
+                out -= np.float32(self.mean / self.std)
+            else:
+                out[...] = self(self.rgb)
+
+    def __call__(self, pixels):
+        if self.dtype == np.uint8:
+            return pixels
+        if self.dtype == np.int8:
+            return np.bitwise_xor(pixels, 0x80).view(np.int8)
+        real = (pixels.astype(np.float32) - self.mean) / self.std
+        if self.scale:
+            return np.round(real / self.scale + self.zero_point).astype(self.dtype)
+        return real.astype(self.dtype)
+
+
+def dequantize(values, output_detail):
+    scale, zero_point = output_detail['quantization']
+    if not scale or values.dtype == np.float32:
+        return values
+    return (values.astype(np.float32) - zero_point) * scale
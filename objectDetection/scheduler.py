@@ -0,0 +1,42 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionScheduler:
+    # Decides per camera frame whether to run inference. The motion score is
+    # the mean absolute difference of tiny gray thumbnails, 0 for a still
+    # scene and around 0.1 when walking. At or below still the detector runs
+    # every idle_interval seconds (the power budget), at or above moving
+    # every busy_interval seconds (the latency budget), in between the
+    # interval scales linearly
+    def __init__(self, busy_interval=0.1, idle_interval=2.0, still=0.01, moving=0.05, size=(32, 24)):
+        self.busy_interval = busy_interval
+        self.idle_interval = idle_interval
+        self.still = still
+        self.moving = moving
+        self.size = size
+        self.previous = None
+        self.last_inference = None
+        self.score = 0.0
+
+    def motion(self, frame):
+        small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), self.size,
+                           interpolation=cv2.INTER_AREA).astype(np.float32)
+        if self.previous is not None:
+            self.score = float(np.abs(small - self.previous).mean()) / 255
+        self.previous = small
+        return self.score
+
+    def interval(self):
+        fraction = min(max((self.score - self.still) / (self.moving - self.still), 0.0), 1.0)
+        return self.idle_interval + fraction * (self.busy_interval - self.idle_interval)
+
+    def should_infer(self, frame, now=None):
+        now = time.perf_counter() if now is None else now
+        self.motion(frame)
+        if self.last_inference is not None and now - self.last_inference < self.interval():
+            return False
+        self.last_inference = now
+        return True
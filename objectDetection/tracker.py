@@ -0,0 +1,95 @@
+import numpy as np
+
+from objectDetection.detections import detection_dtype, iou_matrix
+
+# detection_dtype plus an id that stays with the object across frames
+track_dtype = np.dtype(detection_dtype.descr + [("track_id", np.int32)])
+
+
+class Tracker:
+    # SORT-style tracking without the Kalman filter: boxes move with a
+    # smoothed per-frame velocity and are matched to new detections of the
+    # same class by IoU. A track is reported once it has been seen min_hits
+    # times and keeps being reported for max_misses frames after it was last
+    # seen, so one missed frame does not change the count
+    def __init__(self, iou_threshold=0.3, min_hits=3, max_misses=5, smoothing=0.6):
+        self.iou_threshold = iou_threshold
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        self.smoothing = smoothing
+        self.next_id = 0
+        self.tracks = np.empty(0, dtype=track_dtype)
+        self.velocity = np.empty((0, 4), dtype=np.float32)
+        self.anchor = np.empty((0, 4), dtype=np.float32)  # Box at the last match
+        self.hits = np.empty(0, dtype=np.int32)
+        self.misses = np.empty(0, dtype=np.int32)
+        self.since = np.empty(0, dtype=np.int32)  # Frames since the last match
+
+    def confirmed(self):
+        return self.tracks[self.hits >= self.min_hits]
+
+    def predict(self):
+        # Moves every track one frame ahead, for frames that skip inference
+        self.tracks["box"] += self.velocity
+        self.since += 1
+        return self.confirmed()
+
+    def match(self, detections):
+        iou = iou_matrix(self.tracks["box"], detections["box"])
+        iou[self.tracks["class_id"][:, None] != detections["class_id"][None, :]] = 0
+        # Greedy by IoU, close enough to the Hungarian assignment for the
+        # handful of objects in view
+        pairs = []
+        used_tracks, used_detections = set(), set()
+        for flat in np.argsort(-iou, axis=None):
+            track, detection = divmod(int(flat), iou.shape[1])
+            if iou[track, detection] < self.iou_threshold:
+                break
+            if track not in used_tracks and detection not in used_detections:
+                pairs.append((track, detection))
+                used_tracks.add(track)
+                used_detections.add(detection)
+        return np.array(pairs, dtype=np.intp).reshape(-1, 2)
+
+    def update(self, detections):
+        self.predict()
+        pairs = self.match(detections)
+        tracks, matched = pairs[:, 0], pairs[:, 1]
+
+        # Matched tracks blend the prediction with the detection and update
+        # their velocity from the movement since the last match, which may be
+        # several predicted frames ago
+        new_boxes = (self.smoothing * detections["box"][matched]
+                     + (1 - self.smoothing) * self.tracks["box"][tracks])
+        movement = (new_boxes - self.anchor[tracks]) / self.since[tracks, None]
+        self.velocity[tracks] = 0.5 * self.velocity[tracks] + 0.5 * movement
+        self.tracks["box"][tracks] = new_boxes
+        self.anchor[tracks] = new_boxes
+        self.tracks["score"][tracks] = detections["score"][matched]
+        self.hits[tracks] += 1
+        self.misses += 1
+        self.misses[tracks] = 0
+        self.since[tracks] = 0
+
+        keep = self.misses <= self.max_misses
+        self.tracks, self.velocity, self.anchor = self.tracks[keep], self.velocity[keep], self.anchor[keep]
+        self.hits, self.misses, self.since = self.hits[keep], self.misses[keep], self.since[keep]
+
+        unmatched = np.ones(len(detections), dtype=bool)
+        unmatched[matched] = False
+        self.add(detections[unmatched])
+        return self.confirmed()
+
+    def add(self, detections):
+        count = len(detections)
+        new = np.empty(count, dtype=track_dtype)
+        for field in detection_dtype.names:
+            new[field] = detections[field]
+        new["track_id"] = np.arange(self.next_id, self.next_id + count)
+        self.next_id += count
+        self.tracks = np.concatenate([self.tracks, new])
+        self.velocity = np.concatenate([self.velocity, np.zeros((count, 4), dtype=np.float32)])
+        self.anchor = np.concatenate([self.anchor, new["box"]])
+        self.hits = np.concatenate([self.hits, np.ones(count, dtype=np.int32)])
+        self.misses = np.concatenate([self.misses, np.zeros(count, dtype=np.int32)])
+        self.since = np.concatenate([self.since, np.zeros(count, dtype=np.int32)])
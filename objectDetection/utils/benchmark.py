@@ -0,0 +1,179 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+project_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_dir)
+from objectDetection.detections import names
+from objectDetection.efficientdet import ObjectDetectionStreamer
+
+# Replays recorded frames through the detection stack without a camera and
+# reports per-stage latency percentiles as JSON. Run from the repo root:
+#   python objectDetection/utils/benchmark.py clips/street.mp4 --detectors efficientdet yolos-onnx
+#   python objectDetection/utils/benchmark.py frames/ --output bench.json --compare old.json
+
+stages = ["preprocess", "invoke", "postprocess", "render", "total"]
+
+
+def read_frames(source, max_frames=None):
+    if os.path.isdir(source):
+        for count, path in enumerate(sorted(glob.glob(os.path.join(source, "*")))):
+            if max_frames is not None and count >= max_frames:
+                return
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield frame
+        return
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open {source}")
+    try:
+        count = 0
+        while max_frames is None or count < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            count += 1
+            yield frame
+    finally:
+        cap.release()
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+            "mean_ms": round(float(samples.mean()), 3)}
+
+
+def benchmark(detector, frames, render=True, warmup=3):
+    label = detector if isinstance(detector, str) else type(detector).__name__
+    streamer = ObjectDetectionStreamer(detector=detector, headless=not render)
+    detector = streamer.detector
+
+    load_start = time.perf_counter()
+    detector.load()
+    load_time = time.perf_counter() - load_start
+
+    timings = {stage: [] for stage in stages}
+    labels = Counter()
+    detection_count = 0
+    wall_start = None
+    for index, frame in enumerate(frames):
+        if index == warmup:
+            wall_start = time.perf_counter()
+        start = time.perf_counter()
+        image, inputs = detector.preprocess(frame)
+        preprocessed = time.perf_counter()
+        outputs = detector.invoke(inputs)
+        invoked = time.perf_counter()
+        detections = detector.postprocess(outputs)
+        postprocessed = time.perf_counter()
+        if render:
+            streamer.render(image, detections)
+        end = time.perf_counter()
+        # TFLite outputs are views into the interpreter, which will not
+        # invoke again while they are alive
+        outputs = None
+
+        if index < warmup:
+            continue
+        timings["preprocess"].append(preprocessed - start)
+        timings["invoke"].append(invoked - preprocessed)
+        timings["postprocess"].append(postprocessed - invoked)
+        timings["render"].append(end - postprocessed)
+        timings["total"].append(end - start)
+        detection_count += len(detections)
+        labels.update(names(detections).tolist())
+
+    measured = len(timings["total"])
+    if not measured:
+        raise ValueError("Not enough frames to benchmark after warmup")
+    wall_time = time.perf_counter() - wall_start
+    result = {
+        "detector": label,
+        "frames": measured,
+        "load_s": round(load_time, 3),
+        "throughput_fps": round(measured / wall_time, 2),
+        "stages": {stage: percentiles(samples) for stage, samples in timings.items()
+                   if render or stage != "render"},
+        "detections": {
+            "total": detection_count,
+            "per_frame": round(detection_count / measured, 3),
+            "labels": dict(labels.most_common()),
+        },
+    }
+    if hasattr(detector, "stats"):
+        # Cascade counters include the warmup frames
+        result["cascade"] = detector.stats()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    before = {result["detector"]: result for result in previous["results"]}
+    for result in current["results"]:
+        old = before.get(result["detector"])
+        if old is None:
+            continue
+        print(f"{result['detector']}: {old['throughput_fps']} -> {result['throughput_fps']} fps")
+        for stage, stats in result["stages"].items():
+            if stage not in old["stages"]:
+                continue
+            for key in ("p50_ms", "p95_ms"):
+                delta = stats[key] - old["stages"][stage][key]
+                print(f"  {stage:<12}{key:<8}{old['stages'][stage][key]:>10.2f}{stats[key]:>10.2f}{delta:>+10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="video file or directory of images")
+    parser.add_argument("--detectors", nargs="+", default=["efficientdet"],
+                        help="names from objectDetection.detectors.detector_types")
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--headless", action="store_true", help="skip the render stage")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="previous JSON report to diff against")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "source": args.source,
+        "cpu_count": os.cpu_count(),
+        "results": [],
+    }
+    for name in args.detectors:
+        frames = read_frames(args.source, args.max_frames)
+        report["results"].append(benchmark(name, frames, not args.headless, args.warmup))
+    # ru_maxrss is in kilobytes on Linux and covers the whole run, benchmark
+    # one detector per invocation to attribute memory to it
+    report["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"{args.output} written!")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
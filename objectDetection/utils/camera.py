@@ -0,0 +1,135 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+
+class CameraService:
+    def __init__(self, device=0, buffer_size=4, flip=False, resolution=None):
+        self.device = device
+        self.buffer_size = buffer_size
+        self.flip = flip
+        self.resolution = resolution
+        self.cap = None
+        self.ring = None
+        self.scratch = None
+        self.pins = [0] * buffer_size
+        self.index = -1
+        self.seq = 0
+        self.frame_interval = 1 / 30
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return self
+        self.cap = cv2.VideoCapture(self.device)
+        if not self.cap.isOpened():
+            raise IOError("Cannot open webcam")
+        if self.resolution is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        if fps and fps > 0:
+            self.frame_interval = 1 / fps
+
+        ret, frame = self.cap.read()
+        if not ret:
+            self.cap.release()
+            raise IOError("Can't receive frame from webcam")
+
+        # Preallocate the ring once so the capture loop never allocates
+        self.ring = np.empty((self.buffer_size,) + frame.shape, dtype=frame.dtype)
+        self.scratch = np.empty_like(frame)
+        self._store(frame)
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def _next_slot(self):
+        for offset in range(1, self.buffer_size + 1):
+            slot = (self.index + offset) % self.buffer_size
+            if slot != self.index and not self.pins[slot]:
+                return slot
+        return None
+
+    def _publish(self, slot):
+        with self.condition:
+            self.index = slot
+            self.seq += 1
+            self.condition.notify_all()
+
+    def _store(self, frame):
+        with self.condition:
+            slot = self._next_slot()
+        if self.flip:
+            cv2.flip(frame, -1, self.ring[slot])
+        else:
+            self.ring[slot][...] = frame
+        self._publish(slot)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            with self.condition:
+                slot = self._next_slot()
+            if slot is None:
+                # Every slot is held by a reader, drop this frame
+                self.cap.grab()
+                continue
+            target = self.scratch if self.flip else self.ring[slot]
+            ret, _ = self.cap.read(target)
+            if not ret:
+                time.sleep(self.frame_interval)
+                continue
+            if self.flip:
+                cv2.flip(self.scratch, -1, self.ring[slot])
+            self._publish(slot)
+
+    @contextmanager
+    def frame(self, after=None, timeout=2.0):
+        # Yields a view into the ring buffer, the slot is pinned so the
+        # capture thread will not overwrite it until the block exits
+        deadline = time.time() + timeout
+        with self.condition:
+            while after is not None and self.seq <= after:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    raise IOError("Can't receive frame from webcam")
+            slot = self.index
+            seq = self.seq
+            self.pins[slot] += 1
+        try:
+            yield self.ring[slot], seq
+        finally:
+            with self.condition:
+                self.pins[slot] -= 1
+
+
+camera = None
+camera_lock = threading.Lock()
+
+
+def get_camera(device=0, flip=True):
+    # The camera is mounted upside down on the hat, so frames are rotated
+    # once here instead of in every consumer
+    global camera
+    with camera_lock:
+        if camera is None:
+            camera = CameraService(device=device, flip=flip).start()
+            atexit.register(camera.stop)
+        return camera
@@ -0,0 +1,143 @@
+import argparse
+import glob
+import os
+import sys
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from objectDetection.detections import iou_matrix
+from objectDetection.detectors import DetrDetector, OnnxDetector, YolosDetector, models_dir
+
+# Exports the transformers detectors once to ONNX for onnxruntime, optionally
+# with int8 dynamic quantization, and checks the exported graph against the
+# eager pipeline on real frames. Run from the repo root:
+#   python objectDetection/utils/export_model.py yolos --quantize --check path/to/frames
+
+eager_detectors = {
+    "yolos": (YolosDetector, "yolos-tiny", (682, 512)),
+    "detr": (DetrDetector, "detr-resnet-50", (682, 512)),
+}
+
+
+class ExportWrapper(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        outputs = self.model(pixel_values=pixel_values)
+        return outputs.logits, outputs.pred_boxes
+
+
+def export(name, size, quantize=False):
+    detector_type, file_name, _ = eager_detectors[name]
+    model = detector_type().load().model
+    onnx_path = os.path.join(models_dir, file_name + ".onnx")
+    width, height = size
+    with torch.inference_mode():
+        torch.onnx.export(ExportWrapper(model), torch.zeros(1, 3, height, width), onnx_path,
+                          input_names=["pixel_values"], output_names=["logits", "pred_boxes"],
+                          opset_version=17, do_constant_folding=True)
+    print(f"{onnx_path} written!")
+    paths = [onnx_path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(models_dir, file_name + ".int8.onnx")
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"{int8_path} written!")
+        paths.append(int8_path)
+    return paths
+
+
+def load_frames(image_dir):
+    # Noise gives no confident detections on either side and would always
+    # "match", so parity needs real frames
+    paths = sorted(glob.glob(os.path.join(image_dir, "*")))
+    frames = [frame for frame in (cv2.imread(path) for path in paths) if frame is not None]
+    if not frames:
+        raise ValueError(f"No images found in {image_dir}")
+    return frames
+
+
+def match_detections(expected, actual, iou_threshold=0.5, score_tolerance=0.1):
+    # Greedy one to one matching by class, IoU and score
+    if not len(expected) or not len(actual):
+        return 0
+    iou = iou_matrix(expected["box"], actual["box"])
+    close = ((expected["class_id"][:, None] == actual["class_id"][None, :])
+             & (np.abs(expected["score"][:, None] - actual["score"][None, :]) <= score_tolerance))
+    iou[~close] = 0
+    matched = 0
+    used = set()
+    for row in np.argsort(-iou.max(axis=1)):
+        for column in np.argsort(-iou[row]):
+            if iou[row, column] < iou_threshold:
+                break
+            if column not in used:
+                used.add(column)
+                matched += 1
+                break
+    return matched
+
+
+def check_parity(name, onnx_path, frames, atol, min_match):
+    # The gate is end to end: the transformers processor plus the eager
+    # model against the fused preprocessor plus onnxruntime, on the same
+    # frames. The raw graph difference on identical pixels is only reported
+    detector_type, _, _ = eager_detectors[name]
+    eager = detector_type(frame_resize_dims=None).load()
+    exported = OnnxDetector(onnx_path, threshold=eager.threshold).load()
+    preprocess = exported.fused_preprocess
+
+    worst_logits = worst_boxes = 0.0
+    expected_total = actual_total = matches = 0
+    for frame in frames:
+        pixel_values = preprocess(frame)
+        with torch.inference_mode():
+            outputs = eager.model(pixel_values=torch.from_numpy(pixel_values))
+        logits, pred_boxes = exported.session.run(None, {"pixel_values": pixel_values})
+        probs_eager = outputs.logits.softmax(-1).numpy()
+        probs_onnx = torch.from_numpy(logits).softmax(-1).numpy()
+        worst_logits = max(worst_logits, float(np.abs(probs_eager - probs_onnx).max()))
+        worst_boxes = max(worst_boxes, float(np.abs(outputs.pred_boxes.numpy() - pred_boxes).max()))
+
+        _, eager_detections = eager.detect(frame)
+        _, onnx_detections = exported.detect(frame)
+        expected_total += len(eager_detections)
+        actual_total += len(onnx_detections)
+        matches += match_detections(eager_detections, onnx_detections)
+
+    print(f"{onnx_path}: max prob diff {worst_logits:.5f}, max box diff {worst_boxes:.5f} (limit {atol})")
+    print(f"{onnx_path}: {matches} matched detections, {expected_total} eager, {actual_total} exported")
+    if not expected_total:
+        print("The eager model found nothing in these frames, use frames with objects in them")
+        return False
+    return matches / max(expected_total, actual_total) >= min_match
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", choices=sorted(eager_detectors))
+    parser.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="input size baked into the graph")
+    parser.add_argument("--quantize", action="store_true", help="also write an int8 dynamic quantized graph")
+    parser.add_argument("--check", metavar="IMAGE_DIR",
+                        help="compare detections of the export against the eager pipeline on these images")
+    parser.add_argument("--atol", type=float, default=1e-3, help="reported raw graph tolerance")
+    parser.add_argument("--min-match", type=float, default=0.9,
+                        help="fraction of detections that must match by class, IoU and score")
+    args = parser.parse_args()
+
+    size = tuple(args.size) if args.size else eager_detectors[args.model][2]
+    paths = export(args.model, size, args.quantize)
+    if args.check is not None:
+        frames = load_frames(args.check)
+        # Quantized graphs are reported but only the fp32 graph has to match
+        results = [check_parity(args.model, path, frames, args.atol, args.min_match) for path in paths]
+        if not results[0]:
+            sys.exit("Exported pipeline does not match the eager model")
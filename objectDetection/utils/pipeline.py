@@ -0,0 +1,24 @@
+import threading
+from collections import deque
+
+
+class DropOldestQueue:
+    # Bounded hand-off between pipeline stages. A slow consumer never holds
+    # up the producer, it just sees the newest items
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.items:
+                self.condition.wait(timeout)
+            return self.items.popleft() if self.items else None